@@ -24,11 +24,11 @@ class BVReplacer(ast.NodeTransformer):
 
 
 class SelfPrefixer(ast.NodeTransformer):
-    def __init__(self, name):
-        self.name = name
+    def __init__(self, names):
+        self.names = set(names)
 
     def visit_Name(self, node):
-        if node.id == self.name:
+        if node.id in self.names:
             return ast.Attribute(ast.Name("self", ast.Load()),
                                  node.id, node.ctx)
         return node
@@ -136,9 +136,9 @@ class CoSATarget(VerilogTarget):
         return assumptions
 
     def prefix_io_with_self(self, tree):
-        for name in self.circuit.interface.ports.keys():
-            tree = SelfPrefixer(name).visit(tree)
-        return tree
+        # prefix all of the IO names in a single walk over the tree
+        names = self.circuit.interface.ports.keys()
+        return SelfPrefixer(names).visit(tree)
 
     def replace_bvs(self, tree):
         tree = BVReplacer().visit(tree)
@@ -1,4 +1,7 @@
+import os
+import sys
 import shlex
+import selectors
 import re
 from subprocess import Popen, PIPE, CompletedProcess
 from fault.user_cfg import FaultConfig
@@ -11,50 +14,169 @@ RED = '\x1b[31m'
 BRIGHT = '\x1b[1m'
 RESET_ALL = '\x1b[0m'
 
+# Pre-formatted display text
+OPEN_TAG = (MAGENTA + BRIGHT + '<{}>' + RESET_ALL).format
+CLOSE_TAG = (MAGENTA + BRIGHT + '</{}>' + RESET_ALL).format
+RUNNING_CMD = CYAN + BRIGHT + 'Running command: ' + RESET_ALL
+
+# Matches arguments that don't need shell quoting (same character set that
+# shlex.quote treats as safe)
+SAFE_ARG = re.compile(r'[A-Za-z0-9_@%+=:,./-]+').fullmatch
+
+# Number of bytes to request from a pipe at a time
+READ_SIZE = 65536
+
 
 class PrintDisplay:
-    def __init__(self, mode):
+    def __init__(self, mode, err_str=None):
         self.mode = mode
+        self.err_str = err_str
         self.lines = []
+        self.err_hits = set()
 
-    def print(self, line):
-        line = line.rstrip()
-        if self.mode == 'realtime':
-            print(line)
-        elif self.mode == 'on_error':
-            self.lines.append(line)
+        # strings (and lists of strings) are looked for line-by-line as
+        # output comes in, while regex patterns are searched for in the
+        # full output of each stream, since they may span several lines
+        self.scan_lines = err_str is not None and \
+            not isinstance(err_str, re.Pattern)
+
+        # bind the printing function once, rather than checking the mode
+        # for every line of output
+        if mode == 'realtime':
+            self.print = self._print_realtime
+        elif mode == 'on_error':
+            self.print = self._print_on_error
         else:
-            raise Exception('Invalid mode.')
+            self.print = self._print_invalid
+
+    def _print_realtime(self, line):
+        sys.stdout.write(line.rstrip())
+        sys.stdout.write('\n')
+
+    def _print_on_error(self, line):
+        self.lines.append(line.rstrip())
+
+    def _print_invalid(self, line):
+        raise Exception('Invalid mode.')
+
+    def check_lines(self, text, name):
+        # look for the error pattern in each of the given lines of output
+        # from the named stream, stopping once it has been found in that
+        # stream.  "text" must only contain complete lines, so that the
+        # result doesn't depend on how the output was split into reads.
+        if self.scan_lines and name not in self.err_hits:
+            if any(error_detected(line, self.err_str)
+                   for line in text.split('\n')):
+                self.err_hits.add(name)
 
     def error_printing(self):
-        if self.mode == 'on_error':
-            for line in self.lines:
-                print(line)
+        if self.mode == 'on_error' and len(self.lines) != 0:
+            sys.stdout.write('\n'.join(self.lines) + '\n')
+
+    def process_output(self, stdout, stderr):
+        # generic function to display lines as they are produced as output
+        # and check for errors.  STDOUT and STDERR are read concurrently,
+        # waiting on whichever pipe has data available, so that the
+        # subprocess can never block on a full pipe that isn't being read.
+        # Data is read in large chunks rather than line-by-line to cut down
+        # on the number of read calls, and complete lines are checked for
+        # errors as they arrive rather than rescanning the whole output
+        # afterwards.
+        #
+        # STDOUT lines are displayed as they come in if printing in realtime,
+        # while STDERR is displayed in its entirety after the subprocess
+        # closes its outputs.
+
+        streams = {stdout.fileno(): ('STDOUT', bytearray()),
+                   stderr.fileno(): ('STDERR', bytearray())}
+        realtime_fd = stdout.fileno() if self.mode == 'realtime' else None
+
+        # start of the text in each stream that hasn't been processed
+        # line-by-line yet
+        pos = dict.fromkeys(streams, 0)
 
-    def process_output(self, fd, name):
-        # generic line-processing function to display lines
-        # as they are produced as output in and check for errors.
+        with selectors.DefaultSelector() as sel:
+            for fd in streams:
+                sel.register(fd, selectors.EVENT_READ)
 
-        retval = ''
-        any_line = False
-        for line in fd:
-            # Add line to value to be returned
-            retval += line
+            while len(sel.get_map()) != 0:
+                for key, _ in sel.select():
+                    chunk = os.read(key.fd, READ_SIZE)
+                    if not chunk:
+                        sel.unregister(key.fd)
+                        continue
 
-            # Display opening text if needed
-            if not any_line:
-                any_line = True
-                self.print(MAGENTA + BRIGHT + f'<{name}>' + RESET_ALL)
+                    # Add chunk to value to be returned
+                    name, data = streams[key.fd]
+                    data += chunk
 
-            # display if desired
-            self.print(line)
+                    # Display opening text if needed
+                    if key.fd == realtime_fd and len(data) == len(chunk):
+                        self.print(OPEN_TAG(name))
 
-        # Display closing text if needed
-        if any_line:
-            self.print(MAGENTA + BRIGHT + f'</{name}>' + RESET_ALL)
+                    # skip line processing if there is nothing to do
+                    if key.fd != realtime_fd and (not self.scan_lines or
+                                                  name in self.err_hits):
+                        continue
+
+                    # display and check complete lines (only the new chunk
+                    # can contain a newline that hasn't been seen yet)
+                    start = max(pos[key.fd], len(data) - len(chunk))
+                    end = data.rfind(b'\n', start)
+                    if end != -1:
+                        # decode through the newline, so that a trailing
+                        # \r\n is translated as a whole, then drop it
+                        text = decode_output(data[pos[key.fd]:end + 1])[:-1]
+                        if key.fd == realtime_fd:
+                            for line in text.split('\n'):
+                                self.print(line)
+                        self.check_lines(text, name)
+                        pos[key.fd] = end + 1
+
+        retval = []
+        for fd, (name, data) in streams.items():
+            # decode the full output contents for further processing
+            text = decode_output(data)
+            retval.append(text)
+
+            # search the full output for regex error patterns
+            if self.err_str is not None and not self.scan_lines:
+                if error_detected(text, self.err_str):
+                    self.err_hits.add(name)
+
+            if len(data) == 0:
+                continue
+
+            # display and check any text that hasn't been processed yet
+            # (skipped when it wouldn't be used, to avoid decoding the
+            # output a second time)
+            use_rest = fd == realtime_fd or \
+                (self.scan_lines and name not in self.err_hits)
+            if use_rest and pos[fd] < len(data):
+                rest = decode_output(data[pos[fd]:])
+                if fd == realtime_fd:
+                    self.print(rest)
+                self.check_lines(rest, name)
+            if fd != realtime_fd:
+                self.print(OPEN_TAG(name))
+                self.print(text)
+
+            # Display closing text
+            self.print(CLOSE_TAG(name))
 
         # Return the full output contents for further processing
-        return retval
+        return tuple(retval)
+
+
+def decode_output(data):
+    # Decodes raw subprocess output, translating newlines in the same way
+    # as universal_newlines=True would.  Output is always decoded as UTF-8
+    # (rather than with the locale encoding), and bytes that aren't valid
+    # UTF-8 are replaced with U+FFFD instead of raising an exception.
+    text = data.decode('utf-8', 'replace')
+    if '\r' in text:
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+    return text
 
 
 def error_detected(text, err_str):
@@ -103,6 +225,9 @@ def subprocess_run(args, cwd=None, env=None, disp_type='on_error', err_str=None,
     #          STDERR, raising an AssertionError if it is found.  Note that
     #          "err_str" can be a string, a list of strings, or a regex pattern
     #          (see error_detected documentation for more information).
+    #          Strings are matched one line at a time, so they can't span
+    #          multiple lines; regex patterns are searched for in the full
+    #          text of STDOUT and STDERR, so they can.
     # chk_ret_code: If True, check the return code after the subprocess runs,
     #               raising an AssertionError if it is non-zero.
     # shell: If True, shell-quote arguments and concatenate using spaces into
@@ -111,18 +236,30 @@ def subprocess_run(args, cwd=None, env=None, disp_type='on_error', err_str=None,
     #        Verilator)
     # use_fault_cfg: If True (default) and env is None, then use FaultConfig
     #                to fill in default environment variables.
+    #
+    # STDOUT and STDERR are decoded as UTF-8, with invalid bytes replaced
+    # rather than raising an exception (see decode_output).
+    #
+    # Note on process creation: the subprocess is launched with a plain
+    # fork+exec on most supported Python versions.  Starting with Python
+    # 3.10, CPython on Linux uses vfork instead (cheaper when the parent
+    # process is large, e.g. with magma and CoreIR loaded), but only if no
+    # preexec_fn or user/group change is requested, so avoid adding those
+    # options here.  posix_spawn (Python 3.8+) is not used, since it also
+    # requires close_fds=False and cwd=None.
 
     # set defaults
     if env is None and use_fault_cfg:
         env = FaultConfig().get_sim_env()
 
     # set up printing
-    display = PrintDisplay(mode=disp_type)
+    display = PrintDisplay(mode=disp_type, err_str=err_str)
 
     # print out the command in a format that can be copy-pasted
     # directly into a terminal (i.e., with proper quoting of arguments)
-    cmd_str = ' '.join(shlex.quote(arg) for arg in args)
-    display.print(CYAN + BRIGHT + 'Running command: ' + RESET_ALL + cmd_str)
+    cmd_str = ' '.join(arg if SAFE_ARG(arg) else shlex.quote(arg)
+                       for arg in args)
+    display.print(RUNNING_CMD + cmd_str)
 
     # combine arguments into a string if needed for shell=True
     if shell:
@@ -130,14 +267,14 @@ def subprocess_run(args, cwd=None, env=None, disp_type='on_error', err_str=None,
 
     # run the subprocess
     err_msg = []
-    with Popen(args, cwd=cwd, env=env, stdout=PIPE, stderr=PIPE, bufsize=1,
-               universal_newlines=True, shell=shell) as p:
+    with Popen(args, cwd=cwd, env=env, stdout=PIPE, stderr=PIPE,
+               shell=shell) as p:
 
         # print out STDOUT, then STDERR
-        # threads could be used here but pytest does not detect exceptions
-        # in child threads, so for now the outputs are printed sequentially
-        stdout = display.process_output(fd=p.stdout, name='STDOUT')
-        stderr = display.process_output(fd=p.stderr, name='STDERR')
+        # both pipes are drained in the same loop (rather than threads,
+        # since pytest does not detect exceptions in child threads)
+        stdout, stderr = display.process_output(stdout=p.stdout,
+                                                stderr=p.stderr)
 
         # get return code and check result if desired
         returncode = p.wait()
@@ -145,12 +282,10 @@ def subprocess_run(args, cwd=None, env=None, disp_type='on_error', err_str=None,
         if chk_ret_code and returncode:
             err_msg += [f'Got return code {returncode}.']
 
-        # look for errors in STDOUT or STDERR
-        if err_str is not None:
-            if error_detected(stdout, err_str):
-                err_msg += [f'Found error pattern "{err_str}" in STDOUT.']
-            if error_detected(stderr, err_str):
-                err_msg += [f'Found error pattern "{err_str}" in STDERR.']
+        # report errors found in STDOUT or STDERR
+        for name in ['STDOUT', 'STDERR']:
+            if name in display.err_hits:
+                err_msg += [f'Found error pattern "{err_str}" in {name}.']
 
     # if any errors were found, print out STDOUT and STDERR if they haven't
     # already been printed, then print out what the error(s) were and
@@ -144,27 +144,35 @@ def generate_simulator_test_vectors(circuit, input_ranges=None,
             else:
                 assert True, "can't test Tuples"
 
+    # look up the circuit ports once, rather than for every test vector
+    inputs = [getattr(circuit, name)
+              for name, port in circuit.IO.items() if port.is_input()]
+    outputs = []
+    for name, port in circuit.IO.items():
+        if port.is_output():
+            if issubclass(port, Array) and \
+                    not issubclass(port, (Bits, SInt, UInt)):
+                bv_type = BitVector[len(port)]
+            else:
+                bv_type = None
+            outputs.append((getattr(circuit, name), bv_type))
+
     tests = []
     for test in product(*args):
         testv = [list(test), []]
-        j = 0
-        for i, (name, port) in enumerate(circuit.IO.items()):
-            if port.is_input():
-                val = test[j]
-                if isinstance(val, BitVector):
-                    val = test[j].as_bool_list()
-                simulator.set_value(getattr(circuit, name), val)
-                j += 1
+        for j, port in enumerate(inputs):
+            val = test[j]
+            if isinstance(val, BitVector):
+                val = test[j].as_bool_list()
+            simulator.set_value(port, val)
 
         simulator.evaluate()
 
-        for i, (name, port) in enumerate(circuit.IO.items()):
-            if port.is_output():
-                val = simulator.get_value(getattr(circuit, name))
-                if issubclass(port, Array) and \
-                        not issubclass(port, (Bits, SInt, UInt)):
-                    val = BitVector[len(port)](val)
-                testv[1].append(val)
+        for port, bv_type in outputs:
+            val = simulator.get_value(port)
+            if bv_type is not None:
+                val = bv_type(val)
+            testv[1].append(val)
 
         tests.append(testv)
 
@@ -16,6 +16,7 @@ import math
 from hwtypes import BitVector, AbstractBitVectorMeta
 from fault.random import constrained_random_bv
 from fault.subprocess_run import subprocess_run
+from fault.user_cfg import FaultConfig
 import fault.utils as utils
 import fault.expression as expression
 import platform
@@ -590,6 +591,10 @@ if (!({expr_str})) {{
         with open(driver_file, "w") as f:
             f.write(src)
 
+        # resolve the default simulation environment once, rather than
+        # re-reading the fault config files for every command
+        sim_env = FaultConfig().get_sim_env()
+
         # if use kratos, symbolic link the library to dest folder
         if self.use_kratos:
             from kratos_runtime import get_lib_path
@@ -601,11 +606,12 @@ if (!({expr_str})) {{
             # add ld library path
             env = {"LD_LIBRARY_PATH": os.path.dirname(dst_path)}
         else:
-            env = None
+            env = sim_env
 
         # Run makefile created by verilator
         make_cmd = verilator_make_cmd(self.circuit_name)
-        subprocess_run(make_cmd, cwd=self.directory, disp_type=self.disp_type)
+        subprocess_run(make_cmd, cwd=self.directory, env=sim_env,
+                       disp_type=self.disp_type)
 
         # Run the executable created by verilator and write the standard
         # output to a logfile for later review or processing
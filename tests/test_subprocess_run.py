@@ -0,0 +1,110 @@
+import re
+import sys
+import fault.subprocess_run
+from fault.subprocess_run import subprocess_run, CLOSE_TAG
+
+
+def run_python(code, **kwargs):
+    return subprocess_run([sys.executable, '-c', code], **kwargs)
+
+
+def test_split_multibyte_char_realtime(capsys):
+    # the two bytes of a UTF-8 character arrive in separate reads
+    code = ('import sys, time\n'
+            'out = sys.stdout.buffer\n'
+            'out.write(b"caf\\xc3"); out.flush(); time.sleep(0.2)\n'
+            'out.write(b"\\xa9\\n"); out.flush()\n')
+    result = run_python(code, disp_type='realtime')
+    assert result.stdout == 'café\n'
+    assert 'café\n' in capsys.readouterr().out
+
+
+def test_crlf_realtime(capsys):
+    code = 'import sys; sys.stdout.buffer.write(b"a\\r\\nb\\r\\n")'
+    result = run_python(code, disp_type='realtime')
+    assert result.stdout == 'a\nb\n'
+    assert '\na\nb\n' + CLOSE_TAG('STDOUT') in capsys.readouterr().out
+
+
+def test_invalid_utf8_replaced():
+    code = 'import sys; sys.stdout.buffer.write(b"a\\xffb\\n")'
+    result = run_python(code)
+    assert result.stdout == 'a\ufffdb\n'
+
+
+def test_output_decoded_once(monkeypatch):
+    # in on_error mode without an error pattern, each stream should only
+    # be decoded once
+    sizes = []
+    decode_output = fault.subprocess_run.decode_output
+
+    def counting_decode_output(data):
+        sizes.append(len(data))
+        return decode_output(data)
+
+    monkeypatch.setattr(fault.subprocess_run, 'decode_output',
+                        counting_decode_output)
+    result = run_python('print("x" * 1000000)')
+    assert len(result.stdout) == 1000001
+    assert sum(sizes) == 1000001
+
+
+def test_large_stderr_before_stdout():
+    # the child fills the STDERR pipe before writing anything to STDOUT,
+    # which would block forever if the pipes were drained one at a time
+    code = ('import sys\n'
+            'sys.stderr.write("e" * 200000 + "\\r\\nend")\n'
+            'sys.stderr.flush()\n'
+            'sys.stdout.write("a\\r\\nb\\rc")\n')
+    result = run_python(code)
+    assert result.stderr == 'e' * 200000 + '\nend'
+    assert result.stdout == 'a\nb\nc'
+
+
+def check_err_str(code, err_str, expected):
+    # returns normally only if the error pattern was (or wasn't) detected
+    # as expected
+    try:
+        run_python(code, err_str=err_str)
+    except AssertionError:
+        assert expected, f'Unexpected error detected: {err_str}'
+    else:
+        assert not expected, f'Error not detected: {err_str}'
+
+
+def test_err_str_kinds():
+    code = 'print("fine"); print("an ERROR here")'
+    for err_str in ['ERROR', ['missing', 'ERROR'], re.compile('ERR.R')]:
+        check_err_str(code, err_str, True)
+    for err_str in ['BAD', ['missing', 'BAD'], re.compile('B.D')]:
+        check_err_str(code, err_str, False)
+
+
+def test_err_str_stderr_only(capsys):
+    code = 'import sys; print("fine"); sys.stderr.write("ERROR\\n")'
+    check_err_str(code, 'ERROR', True)
+    out = capsys.readouterr().out
+    assert 'Found error pattern "ERROR" in STDERR.' in out
+    assert 'in STDOUT' not in out
+
+
+def test_err_str_no_trailing_newline():
+    code = 'import sys; sys.stdout.write("fine\\nERROR")'
+    check_err_str(code, 'ERROR', True)
+    check_err_str(code, re.compile('ERROR$'), True)
+
+
+def test_err_str_multiline():
+    # "foo" and "bar" are written separately so that they are likely to
+    # arrive in different reads; the result must not depend on that
+    code = ('import sys, time\n'
+            'print("foo", flush=True); time.sleep(0.2)\n'
+            'print("bar", flush=True)\n')
+
+    # strings are matched line by line, so they can't span lines
+    check_err_str(code, 'foo\nbar', False)
+
+    # regex patterns are searched for in the full output
+    check_err_str(code, re.compile(r'foo\nbar'), True)
+    check_err_str(code, re.compile('^bar'), False)
+    check_err_str(code, re.compile('^bar', re.MULTILINE), True)